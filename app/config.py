@@ -60,5 +60,25 @@ CLOUDINARY_TRANSFORM_DETAIL = "w_600,h_600,c_pad,b_auto,q_auto:good,f_auto"
 # Para Marketplaces (Alta qualidade, tamanho específico se necessário)
 CLOUDINARY_TRANSFORM_MARKETPLACE = "w_1200,h_1200,c_pad,b_rgb:ffffff,q_90" # Ex: 1200x1200 fundo branco, alta qualidade JPG (sem f_auto)
 
+# --- Etiquetas (EAN13 / QR) ---
+# Folha A4 renderizada em pixels (DPI define a resolução da impressão)
+ETIQUETAS_DPI = int(os.getenv("ETIQUETAS_DPI", "200"))
+ETIQUETAS_COLUNAS = int(os.getenv("ETIQUETAS_COLUNAS", "3")) # Ex: Pimaco A4 3x8
+ETIQUETAS_LINHAS = int(os.getenv("ETIQUETAS_LINHAS", "8"))
+# Pasta para cache das imagens de código de barras (reimpressões não re-renderizam)
+ETIQUETAS_CACHE_DIR = os.getenv("ETIQUETAS_CACHE_DIR", os.path.join(".cache", "etiquetas"))
+# Processos para renderizar folhas em paralelo (0 = nº de CPUs)
+ETIQUETAS_WORKERS = int(os.getenv("ETIQUETAS_WORKERS", "0"))
+# Limite de etiquetas por requisição. Medido (PDF, 1 CPU): 3000 -> +11 MB RSS / 24 s; 20000 -> +68 MB / 168 s.
+# O gargalo é o tempo de render, não a memória: 5000 (~209 folhas) cabe num container sem prender o worker web
+ETIQUETAS_MAX_POR_LOTE = int(os.getenv("ETIQUETAS_MAX_POR_LOTE", "5000"))
+
+# --- Feed Incremental (Marketplaces) ---
+FEED_LIMITE_PADRAO = 500 # Peças por página do feed
+# Chave do advisory lock que serializa change log, movimentações e snapshots de estoque
+FEED_LOCK_KEY = 270270
+# Exclusões (tombstones) mais antigas que isso saem na compactação; consumidor mais atrasado recebe recarga_necessaria
+FEED_RETENCAO_EXCLUIDAS_DIAS = int(os.getenv("FEED_RETENCAO_EXCLUIDAS_DIAS", "30"))
+
 # --- Outras Configurações ---
 # ...
\ No newline at end of file
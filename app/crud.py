@@ -1,12 +1,12 @@
 # File: app/crud.py (v5.25 - Correção Final try/except Kit)
 from sqlalchemy.orm import Session, joinedload, selectinload
-from sqlalchemy import func, exc, select, update, delete
-from typing import List, Optional
+from sqlalchemy import func, exc, select, update, delete, insert, union_all
+from typing import List, Optional, Dict
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 from fastapi import UploadFile, HTTPException
-from datetime import date # Importa date corretamente
+from datetime import date, datetime, timedelta # Importa date corretamente
 
 # Importa nossos módulos internos
 from . import models, schemas, config, database
@@ -95,6 +95,7 @@ def create_peca_variacao(db: Session, peca_data: schemas.PecaCreate, image_urls:
         if ean13: db_peca.codigo_ean13 = ean13
         for img_url in image_urls:
             if img_url: db.add(models.PecaImagem(peca_id=peca_id, url_imagem=img_url))
+        registrar_alteracao(db, db_peca)
         db.commit(); db.refresh(db_peca); return db_peca
     except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro SQLA criar peça: {e}"); raise ValueError(f"Erro interno salvar variação.")
 
@@ -108,6 +109,7 @@ def update_peca_variacao(db: Session, peca_id: int, peca_update_data: schemas.Pe
             if key == 'data_ultima_compra': value = value.strftime('%Y-%m-%d') if isinstance(value, date) else None
             elif key in campos_str_upper and isinstance(value, str): value = value.strip().upper() if value else None
             setattr(db_peca, key, value)
+        registrar_alteracao(db, db_peca)
         db.commit(); db.refresh(db_peca); return db_peca
     except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro SQLA update peça {peca_id}: {e}"); raise ValueError("Erro interno atualizar.")
 
@@ -118,6 +120,9 @@ def delete_peca_variacao(db: Session, peca_id: int) -> bool:
     if comp_em_kit: kit_pai = get_peca_by_id(db, comp_em_kit.kit_peca_id); kit_sku = kit_pai.sku_variacao if kit_pai else f"ID {comp_em_kit.kit_peca_id}"; raise ValueError(f"Peça (SKU: {db_peca.sku_variacao}) é componente do Kit {kit_sku}.")
     try:
         # TODO: Deletar imagens Cloudinary
+        registrar_alteracao(db, db_peca, excluida=True)
+        _mover_para_arquivo(db, models.MovimentacaoEstoque.peca_id == peca_id) # Vendas da peça continuam nos relatórios
+        db.expire(db_peca, ["movimentacoes"]) # Já removidas acima; o cascade não precisa apagá-las de novo
         db.delete(db_peca); db.commit(); return True
     # CORREÇÃO: Adicionado bloco except
     except exc.SQLAlchemyError as e:
@@ -133,17 +138,113 @@ def registrar_movimentacao_crud(db: Session, peca_id: int, tipo_mov: str, quanti
     db_peca = get_peca_by_id(db, peca_id);
     if not db_peca: raise ValueError(f"Peça ID {peca_id} não encontrada.")
     try:
-        db_mov = models.MovimentacaoEstoque(peca_id=peca_id, tipo_movimentacao=tipo_mov, quantidade=quantidade, observacao=observacao)
+        mov_data = {}
+        if _travar_escritas(db): # Sob o lock: relê o saldo e carimba a data na ordem de commit (ver gerar_snapshots_crud)
+            db.refresh(db_peca); mov_data["data_movimentacao"] = func.clock_timestamp()
+        db_mov = models.MovimentacaoEstoque(peca_id=peca_id, tipo_movimentacao=tipo_mov, quantidade=quantidade, observacao=observacao, **mov_data)
         db.add(db_mov)
         if tipo_mov == 'Entrada': db_peca.quantidade_estoque = (db_peca.quantidade_estoque or 0) + quantidade
         elif tipo_mov == 'Saida': db_peca.quantidade_estoque = (db_peca.quantidade_estoque or 0) - quantidade
         elif tipo_mov == 'Ajuste': db_peca.quantidade_estoque = quantidade
+        registrar_alteracao(db, db_peca)
         db.commit(); db.refresh(db_peca); return db_peca
     except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB mov: {e}"); raise ValueError("Erro DB mov.")
-def get_movimentacoes_crud(db: Session, peca_id: int, skip: int = 0, limit: int = 50) -> List[models.MovimentacaoEstoque]:
-    try: return db.query(models.MovimentacaoEstoque).filter(models.MovimentacaoEstoque.peca_id == peca_id).order_by(models.MovimentacaoEstoque.data_movimentacao.desc()).offset(skip).limit(limit).all()
+def get_movimentacoes_crud(db: Session, peca_id: int, skip: int = 0, limit: int = 50, incluir_arquivo: bool = True) -> List[models.MovimentacaoEstoque]:
+    try:
+        if not incluir_arquivo: return db.query(models.MovimentacaoEstoque).filter(models.MovimentacaoEstoque.peca_id == peca_id).order_by(models.MovimentacaoEstoque.data_movimentacao.desc()).offset(skip).limit(limit).all()
+        mov = _movimentacoes_ledger() # Linhas com os mesmos atributos do model (id, tipo, quantidade, data...)
+        return db.query(mov).filter(mov.c.peca_id == peca_id).order_by(mov.c.data_movimentacao.desc(), mov.c.id.desc()).offset(skip).limit(limit).all()
     except exc.SQLAlchemyError as e: print(f"Erro DB hist: {e}"); return []
 
+# --- Ledger de Estoque (Snapshots / Arquivo / Saldo em Data) ---
+def _movimentacoes_ledger():
+    # Ativas + arquivadas; o Postgres empurra os filtros para cada lado do UNION ALL (usa idx peca/data)
+    m, a = models.MovimentacaoEstoque, models.MovimentacaoEstoqueArquivo
+    cols = lambda t: select(t.id, t.peca_id, t.tipo_movimentacao, t.quantidade, t.observacao, t.data_movimentacao)
+    return union_all(cols(m), cols(a)).subquery("mov")
+
+def _mover_para_arquivo(db: Session, filtro) -> int:
+    # Copia para o arquivo e apaga das ativas (sem commit: entra na transação de quem chama)
+    m, a = models.MovimentacaoEstoque, models.MovimentacaoEstoqueArquivo
+    colunas = ["id", "peca_id", "tipo_movimentacao", "quantidade", "observacao", "data_movimentacao"]
+    db.execute(insert(a).from_select(colunas, select(*[getattr(m, c) for c in colunas]).where(filtro)))
+    return db.execute(delete(m).where(filtro).execution_options(synchronize_session=False)).rowcount or 0
+
+def estoque_em_data_crud(db: Session, ate: datetime, peca_ids: Optional[List[int]] = None) -> List[schemas.EstoqueEmData]:
+    """Saldo de cada peça em 'ate': snapshot mais recente <= ate + movimentações entre os dois.
+    Sem snapshot anterior, desfaz as movimentações a partir do próximo snapshot (ou do estoque atual);
+    um Ajuste nesse caminho torna o saldo anterior desconhecido (quantidade None)."""
+    snap = models.EstoqueSnapshot; mov = _movimentacoes_ledger()
+    try:
+        q = db.query(models.Peca.id, models.Peca.sku_variacao, models.Peca.quantidade_estoque).filter(models.Peca.data_cadastro <= ate)
+        if peca_ids: q = q.filter(models.Peca.id.in_(peca_ids))
+        pecas = q.order_by(models.Peca.id).all()
+        ids = [p.id for p in pecas]
+        if not ids: return []
+
+        anterior = db.query(snap.peca_id, func.max(snap.data_snapshot).label("ts")).filter(snap.data_snapshot <= ate, snap.peca_id.in_(ids)).group_by(snap.peca_id).subquery()
+        saldos: Dict[int, Optional[int]] = {pid: qtd for pid, qtd in db.query(snap.peca_id, snap.quantidade).join(anterior, (snap.peca_id == anterior.c.peca_id) & (snap.data_snapshot == anterior.c.ts)).all()}
+        delta = (db.query(mov.c.peca_id, mov.c.tipo_movimentacao, mov.c.quantidade).join(anterior, mov.c.peca_id == anterior.c.peca_id)
+                 .filter(mov.c.data_movimentacao > anterior.c.ts, mov.c.data_movimentacao <= ate).order_by(mov.c.peca_id, mov.c.data_movimentacao).all())
+        for pid, tipo, qtd in delta:
+            if tipo == 'Entrada': saldos[pid] += qtd
+            elif tipo == 'Saida': saldos[pid] -= qtd
+            elif tipo == 'Ajuste': saldos[pid] = qtd
+
+        sem_base = [p for p in pecas if p.id not in saldos]
+        if sem_base:
+            ids_sem = [p.id for p in sem_base]
+            posterior = db.query(snap.peca_id, func.min(snap.data_snapshot).label("ts")).filter(snap.data_snapshot > ate, snap.peca_id.in_(ids_sem)).group_by(snap.peca_id).subquery()
+            ancoras = {pid: (ts, qtd) for pid, ts, qtd in db.query(snap.peca_id, snap.data_snapshot, snap.quantidade).join(posterior, (snap.peca_id == posterior.c.peca_id) & (snap.data_snapshot == posterior.c.ts)).all()}
+            for p in sem_base: saldos[p.id] = ancoras[p.id][1] if p.id in ancoras else p.quantidade_estoque
+            reverso = (db.query(mov.c.peca_id, mov.c.tipo_movimentacao, mov.c.quantidade, mov.c.data_movimentacao).filter(mov.c.peca_id.in_(ids_sem), mov.c.data_movimentacao > ate)
+                       .order_by(mov.c.peca_id, mov.c.data_movimentacao.desc()).all())
+            for pid, tipo, qtd, data_mov in reverso:
+                if saldos[pid] is None or (pid in ancoras and data_mov > ancoras[pid][0]): continue
+                if tipo == 'Entrada': saldos[pid] -= qtd
+                elif tipo == 'Saida': saldos[pid] += qtd
+                elif tipo == 'Ajuste': saldos[pid] = None # Saldo antes do Ajuste não é registrado
+    except exc.SQLAlchemyError as e: print(f"Erro DB saldo em data: {e}"); raise ValueError("Erro DB saldo em data.")
+    return [schemas.EstoqueEmData(peca_id=p.id, sku_variacao=p.sku_variacao, quantidade=saldos[p.id]) for p in pecas]
+
+def gerar_snapshots_crud(db: Session, data_snapshot: Optional[datetime] = None) -> int:
+    """Grava o saldo de todas as peças. Sem data usa o estoque atual (exato); com data, reconstrói via estoque_em_data_crud."""
+    try:
+        # Lock nas duas variantes: nenhuma movimentação entra entre a leitura do saldo e a das movimentações
+        travado = _travar_escritas(db)
+        if data_snapshot is None:
+            # Nenhuma movimentação em voo: tudo com data <= agora já está no saldo lido, o resto vem depois
+            data_snapshot = db.query(func.clock_timestamp() if travado else func.now()).scalar()
+            linhas = [{"peca_id": pid, "quantidade": qtd or 0} for pid, qtd in db.query(models.Peca.id, models.Peca.quantidade_estoque).all()]
+        else:
+            linhas = [{"peca_id": s.peca_id, "quantidade": s.quantidade} for s in estoque_em_data_crud(db, data_snapshot) if s.quantidade is not None]
+        if not linhas: return 0
+        for linha in linhas: linha["data_snapshot"] = data_snapshot
+        db.execute(delete(models.EstoqueSnapshot).where(models.EstoqueSnapshot.data_snapshot == data_snapshot)) # Reprocessar a mesma data substitui
+        db.execute(insert(models.EstoqueSnapshot), linhas)
+        db.commit(); return len(linhas)
+    except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB snapshots: {e}"); raise ValueError("Erro DB gerar snapshots.")
+
+def arquivar_movimentacoes_crud(db: Session, antes_de: datetime) -> int:
+    """Move movimentações anteriores a 'antes_de' para o arquivo, gravando antes um snapshot nessa data."""
+    gerar_snapshots_crud(db, antes_de) # Consultas após o corte não precisam ler o arquivo
+    try:
+        movidas = _mover_para_arquivo(db, models.MovimentacaoEstoque.data_movimentacao < antes_de)
+        db.commit(); return movidas
+    except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB arquivar: {e}"); raise ValueError("Erro DB arquivar movimentações.")
+
+def get_vendas_mensais_crud(db: Session, inicio: date, fim: date, peca_id: Optional[int] = None) -> List[schemas.VendasMes]:
+    """Unidades com saída por mês e peça (inclui o arquivo). date_trunc: Postgres."""
+    mov = _movimentacoes_ledger(); mes = func.date_trunc('month', mov.c.data_movimentacao)
+    try:
+        q = (db.query(mes.label("mes"), mov.c.peca_id, func.sum(mov.c.quantidade).label("unidades"))
+             .filter(mov.c.tipo_movimentacao == 'Saida', mov.c.data_movimentacao >= inicio, mov.c.data_movimentacao < fim + timedelta(days=1)))
+        if peca_id: q = q.filter(mov.c.peca_id == peca_id)
+        vendas = q.group_by(mes, mov.c.peca_id).order_by(mes, mov.c.peca_id).all()
+        skus = dict(db.query(models.Peca.id, models.Peca.sku_variacao).filter(models.Peca.id.in_(list({v.peca_id for v in vendas}))).all()) if vendas else {}
+    except exc.SQLAlchemyError as e: print(f"Erro DB vendas mensais: {e}"); raise ValueError("Erro DB vendas mensais.")
+    return [schemas.VendasMes(mes=v.mes.date(), peca_id=v.peca_id, sku_variacao=skus.get(v.peca_id), unidades=int(v.unidades)) for v in vendas]
+
 # --- CRUD Kits (Corrigido try/except) ---
 def set_kit_status_crud(db: Session, peca_id: int, eh_kit: bool):
     db_peca = get_peca_by_id(db, peca_id);
@@ -201,20 +302,107 @@ def add_imagem_crud(db: Session, peca_id: int, url_imagem: str):
     db_peca = get_peca_by_id(db, peca_id);
     if not db_peca: raise ValueError(f"Peça ID {peca_id} não encontrada.")
     if not url_imagem: raise ValueError("URL imagem vazia.")
-    try: db_img = models.PecaImagem(peca_id=peca_id, url_imagem=url_imagem); db.add(db_img); db.commit()
+    try: db_img = models.PecaImagem(peca_id=peca_id, url_imagem=url_imagem); db.add(db_img); registrar_alteracao(db, db_peca); db.commit()
     except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB add img ref: {e}"); raise ValueError("Erro DB add img ref.")
 def remove_imagem_crud(db: Session, imagem_id: int) -> bool:
     try:
         img = db.query(models.PecaImagem).filter(models.PecaImagem.id == imagem_id).first()
-        if img: db.delete(img); db.commit(); return True
+        if img: registrar_alteracao(db, img.peca); db.delete(img); db.commit(); return True
         else: return False
     except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB rem img: {e}"); return False
 def get_imagens_crud(db: Session, peca_id: int) -> List[models.PecaImagem]:
     try: return db.query(models.PecaImagem).filter(models.PecaImagem.peca_id == peca_id).order_by(models.PecaImagem.id).all()
     except exc.SQLAlchemyError as e: print(f"Erro DB get imgs: {e}"); return []
 
+# --- Feed Incremental (Change Log) ---
+def _travar_escritas(db: Session) -> bool:
+    # Advisory lock até o fim da transação (Postgres; reentrante). Serializa change log, movimentações e snapshots
+    if db.get_bind().dialect.name != "postgresql": return False
+    db.execute(select(func.pg_advisory_xact_lock(config.FEED_LOCK_KEY))); return True
+
+def registrar_alteracao(db: Session, db_peca: models.Peca, excluida: bool = False):
+    """Anexa a peça ao change log. Não faz commit: entra na mesma transação da escrita.
+    No Postgres segura o lock de escrita até o commit: seq passa a seguir a ordem de commit, então quem
+    leu o seq M sabe que nenhum seq menor ainda vai aparecer (o cursor 'since' nunca pula alteração)."""
+    _travar_escritas(db)
+    db.add(models.PecaAlteracao(peca_id=db_peca.id, sku_variacao=db_peca.sku_variacao, excluida=excluida))
+
+def url_marketplace(url_imagem: str) -> str:
+    if "/upload/" not in url_imagem: return url_imagem # Não é URL Cloudinary
+    return url_imagem.replace("/upload/", f"/upload/{config.CLOUDINARY_TRANSFORM_MARKETPLACE}/", 1)
+
+def get_feed_pecas_crud(db: Session, since: int = 0, limit: int = config.FEED_LIMITE_PADRAO) -> schemas.FeedPecas:
+    """Peças alteradas após 'since' (uma entrada por peça, na ordem da última alteração) com estado atual."""
+    alt = models.PecaAlteracao
+    try:
+        horizonte = db.query(func.max(models.PecaAlteracaoPurga.excluidas_ate_seq)).scalar()
+        if since > 0 and horizonte is not None and since < horizonte: # since=0 já é carga total, não precisa das exclusões
+            return schemas.FeedPecas(since=since, proximo_since=0, tem_mais=True, recarga_necessaria=True)
+        ultimas = db.query(alt.peca_id, func.max(alt.seq).label("seq")).filter(alt.seq > since).group_by(alt.peca_id).order_by(func.max(alt.seq)).limit(limit + 1).all()
+        tem_mais = len(ultimas) > limit; ultimas = ultimas[:limit]
+        if not ultimas: return schemas.FeedPecas(since=since, proximo_since=since, tem_mais=False)
+        entradas = {a.seq: a for a in db.query(alt).filter(alt.seq.in_([u.seq for u in ultimas])).all()}
+        ids_vivos = [entradas[u.seq].peca_id for u in ultimas if not entradas[u.seq].excluida]
+        pecas = {p.id: p for p in db.query(models.Peca).options(selectinload(models.Peca.imagens)).filter(models.Peca.id.in_(ids_vivos)).all()} if ids_vivos else {}
+    except exc.SQLAlchemyError as e: print(f"Erro DB feed: {e}"); raise ValueError("Erro DB feed.")
+    itens = []
+    for u in ultimas:
+        entrada = entradas[u.seq]; p = pecas.get(entrada.peca_id)
+        if entrada.excluida or p is None: itens.append(schemas.FeedPecaItem(seq=u.seq, peca_id=entrada.peca_id, sku_variacao=entrada.sku_variacao, excluida=True)); continue
+        imagens = [url_marketplace(img.url_imagem) for img in sorted(p.imagens, key=lambda i: i.id)]
+        itens.append(schemas.FeedPecaItem(seq=u.seq, peca_id=p.id, sku_variacao=p.sku_variacao, preco_venda=p.preco_venda, quantidade_estoque=p.quantidade_estoque, imagens=imagens))
+    # Cursor = maior seq entregue; peças com alteração posterior voltam na próxima página
+    return schemas.FeedPecas(since=since, proximo_since=ultimas[-1].seq, tem_mais=tem_mais, itens=itens)
+
+def compactar_feed_crud(db: Session, excluidas_ate_seq: Optional[int] = None, excluidas_dias: int = config.FEED_RETENCAO_EXCLUIDAS_DIAS) -> int:
+    """Mantém só a alteração mais recente de cada peça (o feed entrega estado atual, então nada se perde)
+    e descarta exclusões até 'excluidas_ate_seq' (já lidas por todos) ou, sem ele, mais antigas que 'excluidas_dias'."""
+    alt = models.PecaAlteracao
+    try:
+        mais_recentes = select(func.max(alt.seq)).group_by(alt.peca_id)
+        removidas = db.execute(delete(alt).where(alt.seq.not_in(mais_recentes)).execution_options(synchronize_session=False)).rowcount or 0
+        corte = alt.seq <= excluidas_ate_seq if excluidas_ate_seq is not None else alt.data_alteracao < func.now() - timedelta(days=excluidas_dias)
+        maior_purgado = db.query(func.max(alt.seq)).filter(alt.excluida.is_(True), corte).scalar()
+        if maior_purgado is not None:
+            removidas += db.execute(delete(alt).where(alt.excluida.is_(True), alt.seq <= maior_purgado, corte).execution_options(synchronize_session=False)).rowcount or 0
+            db.add(models.PecaAlteracaoPurga(excluidas_ate_seq=maior_purgado))
+        db.commit(); return removidas
+    except exc.SQLAlchemyError as e: db.rollback(); print(f"Erro DB compactar feed: {e}"); raise ValueError("Erro DB compactar feed.")
+
+# --- Seleção para Etiquetas ---
+def get_pecas_para_etiquetas(db: Session, skus: Optional[List[str]] = None, movimentacao_ids: Optional[List[int]] = None,
+                             cod_montadora: Optional[int] = None, categoria: Optional[str] = None, nome_item: Optional[str] = None,
+                             copias: int = 1, limit: int = config.ETIQUETAS_MAX_POR_LOTE) -> List[models.Peca]:
+    """Lista de peças a etiquetar (repetidas conforme cópias). Lote de movimentação (só Entradas) gera 1 etiqueta por unidade."""
+    pecas: List[models.Peca] = []
+    def adicionar(peca: models.Peca, qtd: int): # Confere o limite antes de expandir a lista
+        if len(pecas) + qtd > limit: raise ValueError(f"Lote excede o limite de {limit} etiquetas.")
+        pecas.extend([peca] * qtd)
+    try:
+        if skus:
+            skus_upper = [s.strip().upper() for s in skus if s and s.strip()]
+            por_sku = {p.sku_variacao: p for p in db.query(models.Peca).filter(models.Peca.sku_variacao.in_(skus_upper)).all()}
+            faltando = [s for s in skus_upper if s not in por_sku]
+            if faltando: raise ValueError(f"SKUs não encontrados: {', '.join(faltando[:20])}.")
+            for sku in skus_upper: adicionar(por_sku[sku], copias) # Mantém a ordem informada
+        if movimentacao_ids:
+            movs = db.query(models.MovimentacaoEstoque).options(joinedload(models.MovimentacaoEstoque.peca)).filter(models.MovimentacaoEstoque.id.in_(movimentacao_ids)).order_by(models.MovimentacaoEstoque.id).all()
+            if not movs: raise ValueError("Nenhuma movimentação encontrada.")
+            # Saída não volta ao estoque e Ajuste guarda o saldo absoluto, não as unidades movidas
+            nao_entrada = [str(m.id) for m in movs if m.tipo_movimentacao != 'Entrada']
+            if nao_entrada: raise ValueError(f"Só movimentações de Entrada geram etiquetas (IDs: {', '.join(nao_entrada[:20])}).")
+            for mov in movs: adicionar(mov.peca, mov.quantidade * copias)
+        if cod_montadora is not None or categoria or nome_item:
+            q = db.query(models.Peca)
+            if cod_montadora is not None: q = q.filter(models.Peca.cod_montadora == cod_montadora)
+            if categoria: q = q.filter(func.upper(models.Peca.categoria) == categoria.strip().upper())
+            if nome_item: q = q.filter(func.upper(models.Peca.nome_item).like(f"%{nome_item.strip().upper()}%"))
+            for p in q.order_by(models.Peca.codigo_base, models.Peca.sku_variacao).limit(limit + 1).all(): adicionar(p, copias)
+    except exc.SQLAlchemyError as e: print(f"Erro DB etiquetas: {e}"); raise ValueError("Erro DB selecionar etiquetas.")
+    return pecas
+
 # --- Helper EAN (Correto) ---
 def generate_ean13(internal_id):
     if not internal_id: return None
-    try: base = f"290{internal_id:09d}"[:12]; return EAN13(base).ean13
+    try: base = f"290{internal_id:09d}"[:12]; return EAN13(base).get_fullcode() # .ean13 não existe nas versões atuais
     except: return None
\ No newline at end of file
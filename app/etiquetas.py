@@ -0,0 +1,185 @@
+# File: app/etiquetas.py (v5.26 - Folhas de Etiquetas EAN13/QR)
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import List, Optional
+
+import qrcode
+from barcode import EAN13
+from barcode.writer import ImageWriter
+from PIL import Image, ImageDraw, ImageFont
+
+from . import config
+
+# Folha A4 (210 x 297 mm) em pixels
+MM_POR_POLEGADA = 25.4
+FOLHA_LARGURA = int(210 / MM_POR_POLEGADA * config.ETIQUETAS_DPI)
+FOLHA_ALTURA = int(297 / MM_POR_POLEGADA * config.ETIQUETAS_DPI)
+MARGEM = int(8 / MM_POR_POLEGADA * config.ETIQUETAS_DPI) # 8 mm
+ETIQUETAS_POR_FOLHA = config.ETIQUETAS_COLUNAS * config.ETIQUETAS_LINHAS
+
+TIPOS_CODIGO = ("ean13", "qr")
+FORMATOS = ("pdf", "png")
+
+# Opções de renderização dos códigos (entram na chave do cache em disco)
+EAN13_OPCOES = {"module_height": 12.0, "module_width": 0.3, "font_size": 8, "text_distance": 4.0, "quiet_zone": 2.0, "dpi": config.ETIQUETAS_DPI}
+QR_OPCOES = {"box_size": 6, "border": 1}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+# --- Cache de imagens de código (memória do processo + disco compartilhado) ---
+def _caminho_cache(tipo_codigo: str, valor: str) -> str:
+    nome_seguro = "".join(c if c.isalnum() else "_" for c in valor)
+    opcoes = EAN13_OPCOES if tipo_codigo == "ean13" else QR_OPCOES
+    versao = hashlib.sha1(repr(sorted(opcoes.items())).encode()).hexdigest()[:8] # Mudou DPI/opções -> novo arquivo
+    return os.path.join(config.ETIQUETAS_CACHE_DIR, f"{tipo_codigo}_{config.ETIQUETAS_DPI}_{versao}_{nome_seguro}.png")
+
+def _render_codigo(tipo_codigo: str, valor: str) -> Image.Image:
+    if tipo_codigo == "ean13":
+        # Passa só os 12 dígitos; o dígito verificador é recalculado pela lib
+        return EAN13(valor[:12], writer=ImageWriter()).render(dict(EAN13_OPCOES))
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, **QR_OPCOES)
+    qr.add_data(valor); qr.make(fit=True)
+    return qr.make_image(fill_color="black", back_color="white") # Wrapper delega p/ PIL.Image
+
+@lru_cache(maxsize=4096)
+def imagem_codigo_png(tipo_codigo: str, valor: str) -> bytes:
+    """Retorna o PNG do código (EAN13 ou QR), usando o cache em disco quando existir."""
+    caminho = _caminho_cache(tipo_codigo, valor)
+    try:
+        with open(caminho, "rb") as f: return f.read()
+    except OSError: pass
+    buf = io.BytesIO(); _render_codigo(tipo_codigo, valor).convert("L").save(buf, format="PNG"); dados = buf.getvalue()
+    try:
+        os.makedirs(config.ETIQUETAS_CACHE_DIR, exist_ok=True)
+        tmp = f"{caminho}.{os.getpid()}.tmp" # Escrita atômica (vários workers podem gravar o mesmo EAN)
+        with open(tmp, "wb") as f: f.write(dados)
+        os.replace(tmp, caminho)
+    except OSError as e: print(f"AVISO: Falha gravar cache etiqueta {caminho}: {e}")
+    return dados
+
+
+# --- Renderização das folhas (executada nos workers) ---
+def _fonte(tamanho: int):
+    try: return ImageFont.load_default(size=tamanho) # Pillow >= 10.1
+    except TypeError: return ImageFont.load_default()
+
+def _cortar_texto(draw: ImageDraw.ImageDraw, texto: str, fonte, largura_max: int) -> str:
+    if draw.textlength(texto, font=fonte) <= largura_max: return texto
+    while texto and draw.textlength(texto + "...", font=fonte) > largura_max: texto = texto[:-1]
+    return texto + "..."
+
+def _desenhar_etiqueta(folha: Image.Image, draw: ImageDraw.ImageDraw, etiqueta: dict, tipo_codigo: str, x: int, y: int, larg: int, alt: int):
+    pad = max(4, larg // 30)
+    fonte_sku = _fonte(max(10, alt // 7)); fonte_txt = _fonte(max(8, alt // 10))
+    draw.text((x + pad, y + pad), etiqueta["sku"], font=fonte_sku, fill=0)
+    linha_y = y + pad + draw.textbbox((0, 0), "Ag", font=fonte_sku)[3] + 2
+    draw.text((x + pad, linha_y), _cortar_texto(draw, etiqueta["nome"], fonte_txt, larg - 2 * pad), font=fonte_txt, fill=0)
+    if etiqueta.get("posicao"):
+        draw.text((x + larg - pad, y + pad), etiqueta["posicao"], font=fonte_txt, fill=0, anchor="ra")
+
+    valor = etiqueta["ean"] if tipo_codigo == "ean13" else etiqueta["sku"]
+    if not valor: return
+    img = Image.open(io.BytesIO(imagem_codigo_png(tipo_codigo, valor)))
+    area_y = linha_y + alt // 8; area_w = larg - 2 * pad; area_h = y + alt - pad - area_y
+    if area_w <= 0 or area_h <= 0: return
+    img.thumbnail((area_w, area_h))
+    folha.paste(img, (x + (larg - img.width) // 2, area_y + (area_h - img.height) // 2))
+
+def _folha_g4(folha: Image.Image) -> bytes:
+    # Página "1" -> fluxo CCITT G4 puro (o strip único do TIFF), pronto p/ embutir no PDF sem redecodificar
+    buf = io.BytesIO(); folha.save(buf, format="TIFF", compression="group4", strip_size=(folha.width + 7) // 8 * folha.height)
+    tif = Image.open(buf); inicio, tamanho = tif.tag_v2[273][0], tif.tag_v2[279][0] # StripOffsets / StripByteCounts
+    return buf.getvalue()[inicio:inicio + tamanho]
+
+def _render_folha(etiquetas: List[dict], tipo_codigo: str, formato: str = "png") -> bytes:
+    folha = Image.new("L", (FOLHA_LARGURA, FOLHA_ALTURA), 255); draw = ImageDraw.Draw(folha)
+    larg = (FOLHA_LARGURA - 2 * MARGEM) // config.ETIQUETAS_COLUNAS
+    alt = (FOLHA_ALTURA - 2 * MARGEM) // config.ETIQUETAS_LINHAS
+    for i, etiqueta in enumerate(etiquetas):
+        lin, col = divmod(i, config.ETIQUETAS_COLUNAS)
+        x = MARGEM + col * larg; y = MARGEM + lin * alt
+        draw.rectangle([x, y, x + larg - 1, y + alt - 1], outline=0) # Guia de corte
+        _desenhar_etiqueta(folha, draw, etiqueta, tipo_codigo, x, y, larg, alt)
+    # Bitonal (limiar, sem dithering): PDF sai em CCITT sem perdas em vez de JPEG, e o PNG fica bem menor
+    folha = folha.point(lambda v: 255 if v >= 128 else 0).convert("1")
+    if formato == "pdf": return _folha_g4(folha)
+    buf = io.BytesIO(); folha.save(buf, format="PNG"); return buf.getvalue()
+
+def _pdf_de_folhas_g4(folhas_g4: List[bytes]) -> bytes:
+    # PDF mínimo: 1 imagem CCITT por página. Só copia bytes (~60 KB/folha), nada é decodificado aqui
+    larg_pt = FOLHA_LARGURA * 72 / config.ETIQUETAS_DPI; alt_pt = FOLHA_ALTURA * 72 / config.ETIQUETAS_DPI
+    n = len(folhas_g4); paginas_ids = [3 + 3 * i for i in range(n)]
+    buf = io.BytesIO(); offsets = {}
+    def obj(num: int, corpo: bytes, stream: Optional[bytes] = None):
+        offsets[num] = buf.tell(); buf.write(f"{num} 0 obj\n".encode() + corpo)
+        if stream is not None: buf.write(b"\nstream\n" + stream + b"\nendstream")
+        buf.write(b"\nendobj\n")
+    buf.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    obj(2, f"<< /Type /Pages /Count {n} /Kids [{' '.join(f'{p} 0 R' for p in paginas_ids)}] >>".encode())
+    for pid, g4 in zip(paginas_ids, folhas_g4):
+        conteudo = f"q {larg_pt:.2f} 0 0 {alt_pt:.2f} 0 0 cm /Im0 Do Q".encode()
+        obj(pid, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {larg_pt:.2f} {alt_pt:.2f}] /Resources << /XObject << /Im0 {pid + 2} 0 R >> /ProcSet [/PDF /ImageB] >> /Contents {pid + 1} 0 R >>".encode())
+        obj(pid + 1, f"<< /Length {len(conteudo)} >>".encode(), conteudo)
+        obj(pid + 2, (f"<< /Type /XObject /Subtype /Image /Width {FOLHA_LARGURA} /Height {FOLHA_ALTURA} /ColorSpace /DeviceGray /BitsPerComponent 1 "
+                      f"/Filter /CCITTFaxDecode /DecodeParms << /K -1 /Columns {FOLHA_LARGURA} /Rows {FOLHA_ALTURA} /BlackIs1 true >> /Length {len(g4)} >>").encode(), g4)
+    xref = buf.tell(); total = 3 + 3 * n
+    buf.write(f"xref\n0 {total}\n0000000000 65535 f \n".encode())
+    buf.write("".join(f"{offsets[i]:010d} 00000 n \n" for i in range(1, total)).encode())
+    buf.write(f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return buf.getvalue()
+
+
+# --- API pública ---
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock: # Chamado de threads do threadpool
+        # spawn: fork dentro do servidor multi-thread pode travar o processo filho
+        if _executor is None: _executor = ProcessPoolExecutor(max_workers=config.ETIQUETAS_WORKERS or None, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None: _executor.shutdown(wait=False, cancel_futures=True); _executor = None
+
+def etiqueta_from_peca(peca, ean_fallback: Optional[str] = None) -> dict:
+    """Converte uma Peca (ORM) em dict simples (serializável para os workers)."""
+    return {"sku": peca.sku_variacao, "nome": peca.nome_item or "", "posicao": peca.posicao_porta or "", "ean": peca.codigo_ean13 or ean_fallback or ""}
+
+def render_folhas(etiquetas: List[dict], tipo_codigo: str = "ean13", formato: str = "png") -> List[bytes]:
+    """Renderiza as folhas distribuindo entre processos: PNG por folha, ou fluxo CCITT G4 se formato == "pdf"."""
+    if tipo_codigo not in TIPOS_CODIGO: raise ValueError(f"Tipo de código inválido: {tipo_codigo}.")
+    if formato not in FORMATOS: raise ValueError(f"Formato inválido: {formato}.")
+    if not etiquetas: raise ValueError("Nenhuma etiqueta para renderizar.")
+    paginas = [etiquetas[i:i + ETIQUETAS_POR_FOLHA] for i in range(0, len(etiquetas), ETIQUETAS_POR_FOLHA)]
+    if len(paginas) == 1: return [_render_folha(paginas[0], tipo_codigo, formato)] # Evita custo do pool p/ lote pequeno
+    for tentativa in range(2):
+        try: return list(get_executor().map(_render_folha, paginas, [tipo_codigo] * len(paginas), [formato] * len(paginas)))
+        except BrokenProcessPool as e: # Worker morreu (OOM/segfault): descarta o pool e recria uma vez
+            print(f"AVISO: Pool de etiquetas quebrado (tentativa {tentativa + 1}): {e}"); shutdown_executor()
+    raise ValueError("Falha ao renderizar etiquetas (processos de renderização encerrados).")
+
+def montar_arquivo(folhas: List[bytes], formato: str = "pdf") -> bytes:
+    """Junta as folhas (de render_folhas no mesmo formato) em um PDF multipágina, PNG único ou ZIP de PNGs."""
+    if formato not in FORMATOS: raise ValueError(f"Formato inválido: {formato}.")
+    if formato == "pdf": return _pdf_de_folhas_g4(folhas)
+    if len(folhas) == 1: return folhas[0]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf: # PNG já é comprimido
+        for i, png in enumerate(folhas, start=1): zf.writestr(f"etiquetas_{i:03d}.png", png)
+    return buf.getvalue()
+
+def gerar_arquivo(etiquetas: List[dict], tipo_codigo: str = "ean13", formato: str = "pdf"):
+    """Renderiza e monta o arquivo final. Retorna (bytes, nº de folhas). Bloqueante: chamar fora do event loop."""
+    folhas = render_folhas(etiquetas, tipo_codigo, formato)
+    return montar_arquivo(folhas, formato), len(folhas)
@@ -8,10 +8,11 @@
     from sqlalchemy.orm import Session
     from typing import List, Optional
     from contextlib import asynccontextmanager # Para lifespan
-    from datetime import date
+    from datetime import date, datetime, time
 
     # Importa nossos módulos internos
-    from app import database, models, schemas, crud, config
+    from fastapi.concurrency import run_in_threadpool
+    from app import database, models, schemas, crud, config, etiquetas
 
     # --- Evento Startup/Shutdown (Opcional, mas bom para logs) ---
     @asynccontextmanager
@@ -24,6 +25,7 @@
         yield
         # Código a ser executado QUANDO o app for parar
         print("INFO:     Finalizando aplicação...")
+        etiquetas.shutdown_executor()
 
     # --- Configuração do App FastAPI ---
     app = FastAPI(title="Gestor de Peças Pro++ API v5.19", lifespan=lifespan)
@@ -133,6 +135,54 @@
         # Precisa criar o template peca_detail.html
         return templates.TemplateResponse( request=request, name="placeholder.html", context={"page_title": f"Detalhes Peça {db_peca.sku_variacao}", "peca": db_peca, "imagens": db_peca.imagens, "lucro": lucro_estimado, "success_message": success_msg, "error_message": error_msg} )
 
+    # --- Ledger de Estoque ---
+    @app.get("/estoque/saldo-em-data", response_model=List[schemas.EstoqueEmData], tags=["Ledger Estoque"])
+    async def get_estoque_em_data(data: date = Query(...), peca_id: Optional[List[int]] = Query(None), db: Session = Depends(get_db)):
+        try: return crud.estoque_em_data_crud(db, datetime.combine(data, time.max), peca_ids=peca_id) # Saldo ao fim do dia
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
+    @app.get("/estoque/vendas-mensais", response_model=List[schemas.VendasMes], tags=["Ledger Estoque"])
+    async def get_vendas_mensais(inicio: date = Query(...), fim: date = Query(...), peca_id: Optional[int] = Query(None, gt=0), db: Session = Depends(get_db)):
+        if fim < inicio: raise HTTPException(status_code=400, detail="'fim' anterior a 'inicio'.")
+        try: return crud.get_vendas_mensais_crud(db, inicio, fim, peca_id=peca_id)
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/estoque/snapshots", tags=["Ledger Estoque"])
+    async def gerar_snapshots(db: Session = Depends(get_db)): # Agendar (ex: cron diário/fim do mês)
+        try: return {"gerados": crud.gerar_snapshots_crud(db)}
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/estoque/arquivar", tags=["Ledger Estoque"])
+    async def arquivar_movimentacoes(antes_de: date = Query(...), db: Session = Depends(get_db)):
+        if antes_de > date.today(): raise HTTPException(status_code=400, detail="Data de corte no futuro.")
+        try: return {"arquivadas": crud.arquivar_movimentacoes_crud(db, datetime.combine(antes_de, time.min))}
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
+    # --- Etiquetas (EAN13 / QR) ---
+    @app.post("/etiquetas", tags=["Etiquetas"])
+    async def gerar_etiquetas(req: schemas.EtiquetasRequest, db: Session = Depends(get_db)):
+        try:
+            pecas = crud.get_pecas_para_etiquetas(db, skus=req.skus, movimentacao_ids=req.movimentacao_ids, cod_montadora=req.cod_montadora,
+                                                  categoria=req.categoria, nome_item=req.nome_item, copias=req.copias)
+            dados = [etiquetas.etiqueta_from_peca(p, crud.generate_ean13(p.id)) for p in pecas]
+            arquivo, n_folhas = await run_in_threadpool(etiquetas.gerar_arquivo, dados, req.tipo_codigo, req.formato) # Render + PDF fora do event loop
+        except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+        if req.formato == "pdf": media_type, nome = "application/pdf", "etiquetas.pdf"
+        elif n_folhas == 1: media_type, nome = "image/png", "etiquetas.png"
+        else: media_type, nome = "application/zip", "etiquetas.zip"
+        return Response(content=arquivo, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{nome}"', "X-Etiquetas-Total": str(len(dados)), "X-Etiquetas-Folhas": str(n_folhas)})
+
+    # --- Feed Incremental (Marketplaces) ---
+    @app.get("/feed/pecas", response_model=schemas.FeedPecas, tags=["Feed Marketplaces"])
+    async def get_feed_pecas(since: int = Query(0, ge=0), limit: int = Query(config.FEED_LIMITE_PADRAO, ge=1, le=5000), db: Session = Depends(get_db)):
+        try: return crud.get_feed_pecas_crud(db, since=since, limit=limit)
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/feed/pecas/compactar", tags=["Feed Marketplaces"])
+    async def compactar_feed(excluidas_ate_seq: Optional[int] = Query(None, ge=0), db: Session = Depends(get_db)):
+        try: return {"removidas": crud.compactar_feed_crud(db, excluidas_ate_seq=excluidas_ate_seq)}
+        except ValueError as e: raise HTTPException(status_code=500, detail=str(e))
+
     # --- Placeholder para outras páginas ---
     @app.get("/{page_name}", response_class=HTMLResponse, include_in_schema=False)
     async def view_placeholder_page(request: Request, page_name: str):
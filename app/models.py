@@ -94,12 +94,34 @@ class PecaImagem(Base):
 class MovimentacaoEstoque(Base):
     __tablename__ = "movimentacoes_estoque"
     id = Column(Integer, primary_key=True, index=True)
-    peca_id = Column(Integer, ForeignKey("pecas.id", ondelete="CASCADE"), nullable=False, index=True)
+    peca_id = Column(Integer, ForeignKey("pecas.id", ondelete="CASCADE"), nullable=False) # Coberto por idx_mov_peca_data
     tipo_movimentacao = Column(String(15), CheckConstraint("tipo_movimentacao IN ('Entrada', 'Saida', 'Ajuste')"), nullable=False)
     quantidade = Column(Integer, nullable=False)
     observacao = Column(Text)
     data_movimentacao = Column(DateTime(timezone=True), server_default=func.now())
     peca = relationship("Peca", back_populates="movimentacoes")
+    __table_args__ = ( Index('idx_mov_peca_data', "peca_id", "data_movimentacao"), ) # Histórico por peça / saldo em data
+
+class MovimentacaoEstoqueArquivo(Base):
+    # Movimentações antigas movidas de movimentacoes_estoque (ver arquivar_movimentacoes_crud). Sem FK: histórico é imutável
+    __tablename__ = "movimentacoes_estoque_arquivo"
+    id = Column(Integer, primary_key=True, autoincrement=False) # Mesmo ID da tabela original
+    peca_id = Column(Integer, nullable=False)
+    tipo_movimentacao = Column(String(15), nullable=False)
+    quantidade = Column(Integer, nullable=False)
+    observacao = Column(Text)
+    data_movimentacao = Column(DateTime(timezone=True), nullable=False)
+    __table_args__ = ( Index('idx_mov_arq_peca_data', "peca_id", "data_movimentacao"),
+                       Index('idx_mov_arq_data', "data_movimentacao"), )
+
+class EstoqueSnapshot(Base):
+    # Saldo da peça num instante (inclui movimentações com data <= data_snapshot)
+    __tablename__ = "estoque_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    peca_id = Column(Integer, ForeignKey("pecas.id", ondelete="CASCADE"), nullable=False)
+    data_snapshot = Column(DateTime(timezone=True), nullable=False)
+    quantidade = Column(Integer, nullable=False)
+    __table_args__ = ( UniqueConstraint('peca_id', 'data_snapshot', name='uq_snapshot_peca_data'), ) # A unique já indexa (peca_id, data)
 
 class ComponenteKit(Base):
     __tablename__ = "componentes_kit"
@@ -112,3 +134,20 @@ class ComponenteKit(Base):
     __table_args__ = ( UniqueConstraint('kit_peca_id', 'componente_peca_id', name='uq_kit_componente'),
                        Index('idx_comp_kit_id', "kit_peca_id"), Index('idx_comp_comp_id', "componente_peca_id"), )
 
+
+class PecaAlteracao(Base):
+    # Change log p/ feed incremental dos marketplaces (seq monotônico; sem FK p/ sobreviver à exclusão da peça)
+    __tablename__ = "pecas_alteracoes"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    peca_id = Column(Integer, nullable=False) # Coberto por idx_alteracoes_peca_seq
+    sku_variacao = Column(String(15), nullable=False)
+    excluida = Column(Boolean, nullable=False, default=False)
+    data_alteracao = Column(DateTime(timezone=True), server_default=func.now())
+    __table_args__ = ( Index('idx_alteracoes_peca_seq', "peca_id", "seq"), )
+
+class PecaAlteracaoPurga(Base):
+    # Registro das exclusões descartadas na compactação: 'since' abaixo do maior seq purgado exige recarga total
+    __tablename__ = "pecas_alteracoes_purgas"
+    id = Column(Integer, primary_key=True)
+    excluidas_ate_seq = Column(Integer, nullable=False)
+    data_purga = Column(DateTime(timezone=True), server_default=func.now())
@@ -110,6 +110,12 @@ class MovimentacaoEstoqueCreate(MovimentacaoEstoqueBase): peca_id: int
 class MovimentacaoEstoque(MovimentacaoEstoqueBase):
     id: int; peca_id: int; data_movimentacao: datetime
     model_config = model_config
+class EstoqueEmData(BaseModel):
+    peca_id: int; sku_variacao: str
+    quantidade: Optional[int] = None # None = indeterminado (Ajuste sem snapshot anterior)
+class VendasMes(BaseModel):
+    mes: date; peca_id: int; sku_variacao: Optional[str] = None # SKU None = peça excluída
+    unidades: int
 
 # --- Kit Schemas ---
 class ComponenteKitBase(BaseModel): componente_peca_id: int; quantidade_componente: int = Field(..., gt=0)
@@ -118,4 +124,31 @@ class ComponenteKit(ComponenteKitBase):
     id: int; kit_peca_id: int
     # componente: Optional[Peca] = None # Opcional
     model_config = model_config
-class KitComComponentes(Peca): componentes_do_kit: List[ComponenteKit] = []; model_config = model_config
\ No newline at end of file
+class KitComComponentes(Peca): componentes_do_kit: List[ComponenteKit] = []; model_config = model_config
+
+# --- Etiquetas Schemas ---
+class EtiquetasRequest(BaseModel):
+    skus: Optional[List[str]] = None
+    movimentacao_ids: Optional[List[int]] = None # Lote de movimentações (1 etiqueta por unidade)
+    cod_montadora: Optional[int] = None
+    categoria: Optional[str] = None
+    nome_item: Optional[str] = None
+    copias: int = Field(1, ge=1, le=100)
+    tipo_codigo: str = Field("ean13", pattern="^(ean13|qr)$")
+    formato: str = Field("pdf", pattern="^(pdf|png)$")
+
+# --- Feed Incremental Schemas ---
+class FeedPecaItem(BaseModel):
+    seq: int
+    peca_id: int
+    sku_variacao: str
+    excluida: bool = False
+    preco_venda: Optional[float] = None
+    quantidade_estoque: Optional[int] = None
+    imagens: List[str] = [] # URLs Cloudinary já com transformação de marketplace
+class FeedPecas(BaseModel):
+    since: int
+    proximo_since: int # Usar como 'since' na próxima chamada
+    tem_mais: bool
+    recarga_necessaria: bool = False # Exclusões após 'since' já foram compactadas: refazer carga com since=0
+    itens: List[FeedPecaItem] = []
@@ -0,0 +1,33 @@
+-- File: sql/001_feed_pecas_alteracoes.sql (v5.27 - Feed Incremental Marketplaces)
+-- O app não roda create_all: aplicar manualmente no Postgres ANTES de subir a versão com o feed
+-- (create/update de peça, movimentações e imagens gravam em pecas_alteracoes).
+--   psql "$DATABASE_URL" -f sql/001_feed_pecas_alteracoes.sql
+-- Idempotente: pode rodar de novo sem duplicar nada.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS pecas_alteracoes (
+    seq SERIAL NOT NULL,
+    peca_id INTEGER NOT NULL,
+    sku_variacao VARCHAR(15) NOT NULL,
+    excluida BOOLEAN NOT NULL DEFAULT false,
+    data_alteracao TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (seq)
+);
+CREATE INDEX IF NOT EXISTS idx_alteracoes_peca_seq ON pecas_alteracoes (peca_id, seq);
+
+CREATE TABLE IF NOT EXISTS pecas_alteracoes_purgas (
+    id SERIAL NOT NULL,
+    excluidas_ate_seq INTEGER NOT NULL,
+    data_purga TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (id)
+);
+
+-- Carga inicial: uma alteração por peça já existente, para o primeiro sync (since=0) receber o catálogo todo
+INSERT INTO pecas_alteracoes (peca_id, sku_variacao, excluida)
+SELECT p.id, p.sku_variacao, false
+FROM pecas p
+WHERE NOT EXISTS (SELECT 1 FROM pecas_alteracoes a WHERE a.peca_id = p.id)
+ORDER BY p.id;
+
+COMMIT;
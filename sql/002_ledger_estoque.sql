@@ -0,0 +1,38 @@
+-- File: sql/002_ledger_estoque.sql (v5.28 - Ledger de Estoque)
+-- O app não roda create_all: aplicar manualmente no Postgres ANTES de subir a versão com o ledger.
+--   psql "$DATABASE_URL" -f sql/002_ledger_estoque.sql
+-- Idempotente. Em tabelas grandes, prefira criar o índice fora de transação com
+-- CREATE INDEX CONCURRENTLY (não bloqueia escritas em movimentacoes_estoque).
+
+BEGIN;
+
+-- Histórico por peça / saldo em data. Substitui o índice simples em peca_id (prefixo deste)
+CREATE INDEX IF NOT EXISTS idx_mov_peca_data ON movimentacoes_estoque (peca_id, data_movimentacao);
+DROP INDEX IF EXISTS ix_movimentacoes_estoque_peca_id;
+
+-- Movimentações antigas (ver arquivar_movimentacoes_crud) e de peças excluídas. Sem FK: histórico imutável
+CREATE TABLE IF NOT EXISTS movimentacoes_estoque_arquivo (
+    id INTEGER NOT NULL,
+    peca_id INTEGER NOT NULL,
+    tipo_movimentacao VARCHAR(15) NOT NULL,
+    quantidade INTEGER NOT NULL,
+    observacao TEXT,
+    data_movimentacao TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_mov_arq_peca_data ON movimentacoes_estoque_arquivo (peca_id, data_movimentacao);
+CREATE INDEX IF NOT EXISTS idx_mov_arq_data ON movimentacoes_estoque_arquivo (data_movimentacao);
+
+-- Saldo da peça num instante (a unique já indexa peca_id, data_snapshot)
+CREATE TABLE IF NOT EXISTS estoque_snapshots (
+    id SERIAL NOT NULL,
+    peca_id INTEGER NOT NULL,
+    data_snapshot TIMESTAMP WITH TIME ZONE NOT NULL,
+    quantidade INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT uq_snapshot_peca_data UNIQUE (peca_id, data_snapshot),
+    FOREIGN KEY (peca_id) REFERENCES pecas (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS ix_estoque_snapshots_id ON estoque_snapshots (id);
+
+COMMIT;